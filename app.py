@@ -11,22 +11,37 @@ Run
 - pip install flask
 - python app.py
 - Open http://127.0.0.1:5000
+- Large files can be streamed without the form: curl -T big.iso http://127.0.0.1:5000/upload/
 
 Note: For quick LAN sharing, run with: flask run --host 0.0.0.0
+Note: In production run under gunicorn (gunicorn -w 4 app:app); its
+wsgi.file_wrapper serves downloads with sendfile(2). --preload is fine: DB
+connections and the expiry sweeper are created per worker on first use.
+Behind a front-end server that understands X-Sendfile, set USE_X_SENDFILE=1
+to hand downloads off to it.
 """
 from __future__ import annotations
 import os
 import sqlite3
+import queue
+import hashlib
 import secrets
+import threading
+import time
 import mimetypes
-from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager, suppress
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
 from typing import Optional
 
 from flask import (
-    Flask, request, redirect, url_for, send_file,
-    abort, flash, Response
+    Flask, request, redirect, send_file,
+    abort, flash, Response, after_this_request
 )
+from markupsafe import Markup
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(APP_ROOT, "uploads")
@@ -35,34 +50,168 @@ DB_PATH = os.path.join(APP_ROOT, "files.db")
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", secrets.token_hex(16))
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 100 MB
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+# Fixed route URLs, used instead of url_for() on the hot paths.
+URL_INDEX = "/"
+URL_UPLOAD = "/upload"
+URL_RECENT = "/recent"
+SMALL_FILE_LIMIT = 64 * 1024  # downloads below this are served from memory
+SWEEP_INTERVAL = 60  # seconds between expiry sweeps
+SWEEP_BATCH = 500  # rows deleted per sweep transaction
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # ---------------------------
 # DB Helpers
 # ---------------------------
 
-def db_conn():
-    conn = sqlite3.connect(DB_PATH)
+_WAL_ENABLED = False
+
+def db_conn(database: str = DB_PATH, uri: bool = False):
+    global _WAL_ENABLED
+    # isolation_level=None: writers issue BEGIN IMMEDIATE / COMMIT themselves.
+    conn = sqlite3.connect(
+        database, uri=uri, check_same_thread=False,
+        isolation_level=None, cached_statements=256,
+    )
     conn.row_factory = sqlite3.Row
+    if not _WAL_ENABLED:
+        # journal_mode is persistent in the db file, so only set it once.
+        conn.execute("PRAGMA journal_mode=WAL")
+        _WAL_ENABLED = True
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
-with db_conn() as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS files (
-            id TEXT PRIMARY KEY,
-            stored_name TEXT NOT NULL,
-            original_name TEXT NOT NULL,
-            size_bytes INTEGER NOT NULL,
-            mime TEXT,
-            created_at TEXT NOT NULL,
-            expires_at TEXT,
-            one_time INTEGER NOT NULL DEFAULT 0,
-            downloads INTEGER NOT NULL DEFAULT 0
+class ConnectionPool:
+    """One lock-serialized writer plus a queue of read-only connections.
+
+    Connections are opened on first use in each process and never shared
+    across fork(), so pre-forking servers (gunicorn --preload) are safe as
+    long as close() is called before forking.
+    """
+
+    def __init__(self, path: str, readers: int):
+        self._path = path
+        self._reader_count = readers
+        self._pid: Optional[int] = None
+        self._open_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            # The writer is opened first so WAL is enabled before any reader.
+            self._writer = db_conn(self._path)
+            self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+            uri = Path(self._path).as_uri() + "?mode=ro"
+            for _ in range(self._reader_count):
+                self._readers.put(db_conn(uri, uri=True))
+            self._pid = os.getpid()
+
+    def close(self):
+        with self._open_lock:
+            if self._pid is None:
+                return
+            self._writer.close()
+            while not self._readers.empty():
+                self._readers.get_nowait().close()
+            self._pid = None
+
+    @contextmanager
+    def read_conn(self):
+        self._ensure_open()
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def write_conn(self):
+        self._ensure_open()
+        with self._write_lock:
+            conn = self._writer
+            # Take the write lock up front instead of failing mid-transaction.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+# UPDATE/DELETE ... RETURNING landed in SQLite 3.35.
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+# Hot-path statements. Each pooled connection keeps these prepared in its
+# statement cache, so they are compiled once per connection, not per request.
+SQL_GET_FILE = "SELECT * FROM files WHERE id=?"
+SQL_RECENT = (
+    "SELECT id, original_name, size_bytes FROM files "
+    "ORDER BY created_at DESC, rowid DESC LIMIT 20"
+)
+SQL_INSERT_FILE = """
+    INSERT INTO files (id, stored_name, original_name, size_bytes, mime, created_at, expires_at, one_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_BUMP_DOWNLOADS = "UPDATE files SET downloads=downloads+1 WHERE id=?"
+SQL_BUMP_DOWNLOADS_RETURNING = SQL_BUMP_DOWNLOADS + " RETURNING *"
+SQL_DELETE_FILE = "DELETE FROM files WHERE id=?"
+SQL_DELETE_FILE_RETURNING = SQL_DELETE_FILE + " RETURNING stored_name"
+
+pool = ConnectionPool(DB_PATH, readers=os.cpu_count() or 4)
+read_conn = pool.read_conn
+write_conn = pool.write_conn
+
+FILES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        id TEXT PRIMARY KEY,
+        stored_name TEXT NOT NULL,
+        original_name TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        mime TEXT,
+        created_at INTEGER NOT NULL,
+        expires_at INTEGER,
+        one_time INTEGER NOT NULL DEFAULT 0,
+        downloads INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+with write_conn() as conn:
+    conn.execute(FILES_SCHEMA)
+    columns = {r["name"]: r["type"] for r in conn.execute("PRAGMA table_info(files)")}
+    if columns["created_at"] == "TEXT":
+        # Older databases stored ISO-8601 strings; rebuild with unix epochs.
+        conn.execute("ALTER TABLE files RENAME TO files_old")
+        conn.execute(FILES_SCHEMA)
+        conn.execute(
+            """
+            INSERT INTO files
+            SELECT id, stored_name, original_name, size_bytes, mime,
+                   CAST(strftime('%s', created_at) AS INTEGER),
+                   CAST(strftime('%s', expires_at) AS INTEGER),
+                   one_time, downloads
+            FROM files_old
+            """
         )
-        """
+        conn.execute("DROP TABLE files_old")
+    # recent() scans idx_files_created backwards, newest first, with rowid breaking
+    # ties within a second; the sweeper only looks at rows with an expiry.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_created ON files(created_at)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_expires ON files(expires_at) "
+        "WHERE expires_at IS NOT NULL"
     )
-    conn.commit()
+
+# Don't carry open SQLite connections into forked workers.
+pool.close()
 
 # ---------------------------
 # HTML Templates (inline)
@@ -125,7 +274,7 @@ INDEX_HTML = """
   <meta name="twitter:image" content="logo.png">
 
   <!-- 🎨 CSS -->
-  <style>{BASE_CSS}</style>
+  <link rel="stylesheet" href="{{ css_url }}">
 </head>
 <body>
 
@@ -138,7 +287,7 @@ INDEX_HTML = """
       </div>
     </div>
     <div class='content'>
-      <form method='post' action='{upload_url}' enctype='multipart/form-data' class='grid'>
+      <form method='post' action='{{ upload_url }}' enctype='multipart/form-data' class='grid'>
         <div>
           <div class='label'>Choose file</div>
           <input class='input file' type='file' name='file' required>
@@ -158,7 +307,7 @@ INDEX_HTML = """
         </div>
         <div class='row'>
           <button class='btn' type='submit'>Upload & Get Link</button>
-          <a class='btn secondary' href='{list_url}'>My recent files</a>
+          <a class='btn secondary' href='{{ list_url }}'>My recent files</a>
         </div>
         <div class='footer'>Max 100 MB per file. Avoid sensitive data for public servers.</div>
       </form>
@@ -172,49 +321,70 @@ INDEX_HTML = """
 DETAIL_HTML = """
 <!doctype html>
 <html><head><meta charset='utf-8'><meta name='viewport' content='width=device-width, initial-scale=1'>
-<title>File • {fid}</title>
+<title>File • {{ fid }}</title>
 <!-- Adding logo -->
 <link rel="icon" type="image/png" href="logo.png">
 
-<style>{BASE_CSS}</style></head>
+<link rel="stylesheet" href="{{ css_url }}"></head>
 <body>
 <div class='container'>
   <div class='card'>
     <div class='header'>
       <div>
-        <div class='title'>{original_name}</div>
-        <div class='sub'>Share ID: <span class='code'>{fid}</span></div>
+        <div class='title'>{{ original_name }}</div>
+        <div class='sub'>Share ID: <span class='code'>{{ fid }}</span></div>
       </div>
-      <a href='{home_url}' class='btn secondary'>New upload</a>
+      <a href='{{ home_url }}' class='btn secondary'>New upload</a>
     </div>
     <div class='content'>
-      {error_block}
+      {% if expired %}
+      <div class='alert error'>This file link has expired.</div>
+      {% endif %}
       <div class='meta'>
-        <div><b>Size</b><br>{size_human}</div>
-        <div><b>MIME</b><br>{mime}</div>
-        <div><b>Created</b><br>{created_at}</div>
-        <div><b>Expires</b><br>{expires_text}</div>
-        <div><b>Downloads</b><br>{downloads}</div>
-        <div><b>Mode</b><br>{mode_text}</div>
+        <div><b>Size</b><br>{{ size_human }}</div>
+        <div><b>MIME</b><br>{{ mime }}</div>
+        <div><b>Created</b><br>{{ created_at }}</div>
+        <div><b>Expires</b><br>{{ expires_text }}</div>
+        <div><b>Downloads</b><br>{{ downloads }}</div>
+        <div><b>Mode</b><br>{{ mode_text }}</div>
       </div>
       <div class='row' style='margin-top:14px'>
-        {download_button}
+        {% if expired %}
+        <button class='btn danger' disabled>Unavailable</button>
+        {% else %}
+        <a class='btn' href='{{ download_url }}'>Download</a>
+        {% endif %}
         <button class='btn secondary' onclick='copyLink()'>Copy Share Link</button>
       </div>
-      <div class='linkbox code' id='share'>{share_url}</div>
+      <div class='linkbox code' id='share'>{{ share_url }}</div>
     </div>
   </div>
 </div>
 <script>
-function copyLink(){{
+function copyLink(){
   const el = document.getElementById('share');
   navigator.clipboard.writeText(el.textContent.trim());
-}}
+}
 </script>
 </body></html>
 """
 # ...existing code...
 
+ITEM_HTML = """
+<div style='padding:12px;border:1px solid #233a6c;border-radius:12px;'>
+  <div style='display:flex;justify-content:space-between;gap:12px;align-items:center;'>
+    <div>
+      <div><b>{{ r['original_name'] }}</b></div>
+      <div class='sub'>{{ r['id'] }} • {{ size_human }}</div>
+    </div>
+    <div class='row'>
+      <a class='btn' href='{{ open_url }}'>Open</a>
+      <a class='btn secondary' href='{{ download_url }}'>Download</a>
+    </div>
+  </div>
+</div>
+"""
+
 LIST_HTML = """
 <!doctype html>
 <html><head><meta charset='utf-8'><meta name='viewport' content='width=device-width, initial-scale=1'>
@@ -222,7 +392,7 @@ LIST_HTML = """
 <!-- Adding logo -->
 <link rel="icon" type="image/png" href="logo.png">
 
-<style>{BASE_CSS}</style></head>
+<link rel="stylesheet" href="{{ css_url }}"></head>
 <body>
 <div class='container'>
   <div class='card'>
@@ -231,224 +401,398 @@ LIST_HTML = """
         <div class='title'>Recent Files</div>
         <div class='sub'>Newest first • Temporary list (server memory)</div>
       </div>
-      <a href='{home_url}' class='btn secondary'>Back</a>
+      <a href='{{ home_url }}' class='btn secondary'>Back</a>
     </div>
     <div class='content'>
-      {files_block}
+      {{ files_block }}
     </div>
   </div>
 </div>
 </body></html>
 """
 
+# BASE_CSS is served from its own URL so browsers cache it across pages. The
+# ETag doubles as a version in the URL, so the long max-age is safe.
+BASE_CSS_BYTES = BASE_CSS.encode()
+CSS_ETAG = hashlib.blake2b(BASE_CSS_BYTES, digest_size=8).hexdigest()
+app.jinja_env.globals["css_url"] = f"/static/app.css?v={CSS_ETAG}"
+
+# Templates are compiled once here with autoescaping on.
+def _compile(template: str):
+    return app.jinja_env.from_string(template)
+
+_index_tmpl = _compile(INDEX_HTML)
+_detail_tmpl = _compile(DETAIL_HTML)
+_item_tmpl = _compile(ITEM_HTML)
+_list_tmpl = _compile(LIST_HTML)
+
+# The index page has no per-request content.
+INDEX_PAGE = _index_tmpl.render(upload_url=URL_UPLOAD, list_url=URL_RECENT)
+
 # ---------------------------
 # Utilities
 # ---------------------------
 
-def utcnow() -> datetime:
-    return datetime.now(timezone.utc)
+def now_ts() -> int:
+    return int(time.time())
 
-def to_iso(dt: Optional[datetime]) -> Optional[str]:
-    return dt.astimezone(timezone.utc).isoformat() if dt else None
+@lru_cache(maxsize=1024)
+def format_ts(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
 
-def from_iso(s: Optional[str]) -> Optional[datetime]:
-    return datetime.fromisoformat(s) if s else None
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
 
 def human_size(n: int) -> str:
-    units = ["B", "KB", "MB", "GB", "TB"]
-    i = 0
-    f = float(n)
-    while f >= 1024 and i < len(units) - 1:
-        f /= 1024
-        i += 1
-    return f"{f:.2f} {units[i]}"
+    if n < 1024:
+        return f"{n} B"
+    # Each unit is 2**10 of the previous one, so the bit length picks it.
+    i = min((n.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{n / (1 << (10 * i)):.2f} {_SIZE_UNITS[i]}"
 
 # ---------------------------
 # Routes
 # ---------------------------
 
-@app.route("/")
+@app.route(URL_INDEX)
 def index():
-    html = INDEX_HTML.format(
-        upload_url=url_for("upload"),
-        list_url=url_for("recent"),
-        BASE_CSS=BASE_CSS
+    return Response(INDEX_PAGE, mimetype="text/html")
+
+@app.get("/static/app.css")
+def app_css():
+    resp = Response(
+        BASE_CSS_BYTES,
+        mimetype="text/css",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
     )
-    return Response(html, mimetype="text/html")
+    resp.set_etag(CSS_ETAG)
+    return resp.make_conditional(request)
 
-@app.post("/upload")
+@app.post(URL_UPLOAD)
 def upload():
     f = request.files.get("file")
     if not f or f.filename == "":
         flash("No file selected.")
-        return redirect(url_for("index"))
+        return redirect(URL_INDEX)
 
     original_name = secure_filename(f.filename)
+    fid, stored_name, path = _new_upload_path(original_name)
+
+    size_bytes = _save_stream(f.stream, path)
+
+    _record_upload(
+        fid, stored_name, original_name, size_bytes,
+        hours=request.form.get("expires", type=int, default=24),
+        one_time=request.form.get("mode") == "one",
+    )
+    return redirect(f"/f/{fid}")
+
+@app.put("/upload/<name>")
+def upload_stream(name: str):
+    """Raw-body upload, e.g. ``curl -T big.iso http://host/upload/``.
+
+    The body is written straight to UPLOAD_DIR instead of going through
+    Werkzeug's multipart parser and its spooled temp file. Expiry and mode
+    come from the query string (``?expires=24&mode=one``).
+    """
+    original_name = secure_filename(name)
+    if not original_name:
+        abort(400)
+    # Werkzeug < 2.3 doesn't apply MAX_CONTENT_LENGTH to request.stream, so
+    # enforce it here and again while copying (chunked bodies have no length).
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    if limit is not None and (request.content_length or 0) > limit:
+        abort(413)
+    fid, stored_name, path = _new_upload_path(original_name)
+
+    size_bytes = _save_stream(request.stream, path)
+
+    _record_upload(
+        fid, stored_name, original_name, size_bytes,
+        hours=request.args.get("expires", type=int, default=24),
+        one_time=request.args.get("mode") == "one",
+    )
+    share_url = request.url_root.strip("/") + f"/f/{fid}"
+    return Response(share_url + "\n", status=201, mimetype="text/plain",
+                    headers={"Location": share_url})
+
+def _new_upload_path(original_name: str) -> tuple[str, str, str]:
     ext = os.path.splitext(original_name)[1]
     fid = secrets.token_urlsafe(8)
-    stored_name = f"{fid}{ext}"
-    path = os.path.join(UPLOAD_DIR, stored_name)
-
-    f.save(path)
-    size_bytes = os.path.getsize(path)
+    # Shard by the first two id characters so no directory grows unbounded.
+    os.makedirs(os.path.join(UPLOAD_DIR, fid[:2]), exist_ok=True)
+    stored_name = f"{fid[:2]}/{fid}{ext}"
+    return fid, stored_name, os.path.join(UPLOAD_DIR, stored_name)
+
+def _save_stream(stream, path: str) -> int:
+    """Copy ``stream`` to ``path`` and return the number of bytes written.
+
+    Aborts with 413 past MAX_CONTENT_LENGTH.
+    """
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    size_bytes = 0
+    try:
+        with open(path, "wb", buffering=UPLOAD_CHUNK_SIZE) as out:
+            while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                size_bytes += len(chunk)
+                if limit is not None and size_bytes > limit:
+                    abort(413)
+                out.write(chunk)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    return size_bytes
+
+def _record_upload(fid: str, stored_name: str, original_name: str,
+                   size_bytes: int, hours: Optional[int], one_time: bool):
     mime, _ = mimetypes.guess_type(original_name)
 
-    hours = request.form.get("expires", type=int, default=24)
-    expires_at: Optional[datetime] = None
+    created_at = now_ts()
+    expires_at: Optional[int] = None
     if hours and hours > 0:
-        expires_at = utcnow() + timedelta(hours=min(hours, 24*7))
+        expires_at = created_at + min(hours, 24*7) * 3600
 
-    one_time = 1 if request.form.get("mode") == "one" else 0
-
-    with db_conn() as conn:
+    with write_conn() as conn:
         conn.execute(
-            """
-            INSERT INTO files (id, stored_name, original_name, size_bytes, mime, created_at, expires_at, one_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
+            SQL_INSERT_FILE,
             (
                 fid,
                 stored_name,
                 original_name,
                 size_bytes,
                 mime,
-                to_iso(utcnow()),
-                to_iso(expires_at),
-                one_time,
+                created_at,
+                expires_at,
+                1 if one_time else 0,
             ),
         )
-        conn.commit()
-
-    return redirect(url_for("view_file", fid=fid))
 
 @app.get("/f/<fid>")
 def view_file(fid: str):
-    with db_conn() as conn:
-        row = conn.execute("SELECT * FROM files WHERE id=?", (fid,)).fetchone()
+    with read_conn() as conn:
+        row = conn.execute(SQL_GET_FILE, (fid,)).fetchone()
     if not row:
         abort(404)
 
-    expires_at = from_iso(row["expires_at"]) if row["expires_at"] else None
-    expired = expires_at and utcnow() > expires_at
+    expires_at = row["expires_at"]
+    expired = expires_at is not None and now_ts() > expires_at
+
+    # The page only changes when the download counter does.
+    etag = None if expired else f"{fid}-{row['downloads']}"
+    if etag and request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag, weak=True)
+        return resp
 
     if expired:
-        _delete_file_record(row)
-        error_block = "<div class='alert error'>This file link has expired.</div>"
-        downloadable = False
-    else:
-        error_block = ""
-        downloadable = True
-
-    download_button = (
-        f"<a class='btn' href='{url_for('download', fid=fid)}'>Download</a>"
-        if downloadable else "<button class='btn danger' disabled>Unavailable</button>"
-    )
+        # Clean up once the page is sent; the sweeper covers anything missed.
+        _after_response(_delete_file_record, fid)
 
-    share_url = request.url_root.strip("/") + url_for("view_file", fid=fid)
+    share_url = request.url_root.strip("/") + f"/f/{fid}"
 
-    html = DETAIL_HTML.format(
-        BASE_CSS=BASE_CSS,
+    html = _detail_tmpl.render(
         fid=fid,
         original_name=row["original_name"],
-        home_url=url_for("index"),
+        home_url=URL_INDEX,
         size_human=human_size(row["size_bytes"]),
         mime=row["mime"] or "unknown",
-        created_at=row["created_at"],
-        expires_text=(expires_at.isoformat() if expires_at else "Never"),
+        created_at=format_ts(row["created_at"]),
+        expires_text=(format_ts(expires_at) if expires_at is not None else "Never"),
         downloads=row["downloads"],
         mode_text="One-time" if row["one_time"] else "Standard",
-        download_button=download_button,
+        expired=expired,
+        download_url=f"/d/{fid}",
         share_url=share_url,
-        error_block=error_block
     )
-    return Response(html, mimetype="text/html")
+    resp = Response(html, status=410 if expired else 200, mimetype="text/html")
+    if etag:
+        resp.set_etag(etag, weak=True)
+    return resp
 
 @app.get("/d/<fid>")
 def download(fid: str):
-    with db_conn() as conn:
-        row = conn.execute("SELECT * FROM files WHERE id=?", (fid,)).fetchone()
+    with write_conn() as conn:
+        if HAS_RETURNING:
+            row = conn.execute(SQL_BUMP_DOWNLOADS_RETURNING, (fid,)).fetchone()
+        else:
+            row = conn.execute(SQL_GET_FILE, (fid,)).fetchone()
+            if row:
+                conn.execute(SQL_BUMP_DOWNLOADS, (fid,))
     if not row:
         abort(404)
 
-    expires_at = from_iso(row["expires_at"]) if row["expires_at"] else None
-    if expires_at and utcnow() > expires_at:
-        _delete_file_record(row)
+    expires_at = row["expires_at"]
+    if expires_at is not None and now_ts() > expires_at:
+        _after_response(_delete_file_record, fid)
         abort(410)
 
+    # Both paths open the file themselves, so a missing file (or one the
+    # sweeper just unlinked) surfaces here rather than via a separate check.
     file_path = os.path.join(UPLOAD_DIR, row["stored_name"])
-    if not os.path.exists(file_path):
-        _delete_row_only(row["id"])
+    try:
+        if row["size_bytes"] < SMALL_FILE_LIMIT:
+            resp = _send_small_file(file_path, row)
+        else:
+            resp = send_file(
+                file_path,
+                as_attachment=True,
+                download_name=row["original_name"],
+                mimetype=row["mime"] or "application/octet-stream",
+                # One-time files ignore Range: a "bytes=0-" 206 would carry the
+                # whole file without ever counting as a complete download.
+                conditional=not row["one_time"],
+                etag=fid,
+                last_modified=row["created_at"],
+            )
+    except FileNotFoundError:
+        _after_response(_delete_row_only, fid)
         abort(404)
 
-    with db_conn() as conn:
-        conn.execute("UPDATE files SET downloads=downloads+1 WHERE id=?", (fid,))
-        conn.commit()
-
-    resp = send_file(
-        file_path,
-        as_attachment=True,
-        download_name=row["original_name"],
-        mimetype=row["mime"] or "application/octet-stream",
-        conditional=True,
-    )
-
-    if row["one_time"]:
-        @resp.call_on_close
-        def _cleanup():
-            try:
-                _delete_file_record(row)
-            except Exception:
-                pass
+    # One-time files are removed only after the full body was sent, so an
+    # aborted transfer leaves the file for the client to retry. HEAD responses
+    # never iterate the body, so they are left unwrapped and don't count.
+    if row["one_time"] and resp.status_code == 200 and request.method != "HEAD":
+        if resp.headers.pop("X-Sendfile", None):
+            # The front-end server can't report completion; stream it ourselves.
+            resp.response = wrap_file(request.environ, open(file_path, "rb"))
+        resp.response = _call_when_sent(
+            resp.response, row["size_bytes"], lambda: _delete_file_record(fid)
+        )
 
     return resp
 
-@app.get("/recent")
+def _send_small_file(file_path: str, row: sqlite3.Row) -> Response:
+    """Answer from memory, skipping send_file()'s stat and Range handling.
+
+    Files this small fit in a single write, so Range support buys nothing.
+    If-None-Match and If-Modified-Since are still answered with 304.
+    """
+    with open(file_path, "rb") as fh:
+        data = fh.read()
+    resp = Response(data, mimetype=row["mime"] or "application/octet-stream")
+    resp.headers.set("Content-Disposition", "attachment", filename=row["original_name"])
+    resp.set_etag(row["id"])
+    resp.last_modified = row["created_at"]
+    return resp.make_conditional(request)
+
+@app.get(URL_RECENT)
 def recent():
-    with db_conn() as conn:
-        rows = conn.execute(
-            "SELECT id, original_name, size_bytes FROM files ORDER BY created_at DESC LIMIT 20"
-        ).fetchall()
-
-    items_html = ""
-    for r in rows:
-        items_html += f"""
-        <div style='padding:12px;border:1px solid #233a6c;border-radius:12px;'>
-          <div style='display:flex;justify-content:space-between;gap:12px;align-items:center;'>
-            <div>
-              <div><b>{r['original_name']}</b></div>
-              <div class='sub'>{r['id']} • {human_size(r['size_bytes'])}</div>
-            </div>
-            <div class='row'>
-              <a class='btn' href='{url_for("view_file", fid=r['id'])}'>Open</a>
-              <a class='btn secondary' href='{url_for("download", fid=r['id'])}'>Download</a>
-            </div>
-          </div>
-        </div>
-        """
-    if not items_html:
-        items_html = "<div class='alert'>No files yet. Upload one!</div>"
+    with read_conn() as conn:
+        rows = conn.execute(SQL_RECENT).fetchall()
+
+    items_html = "".join(
+        _item_tmpl.render(
+            r=r,
+            size_human=human_size(r["size_bytes"]),
+            open_url=f"/f/{r['id']}",
+            download_url=f"/d/{r['id']}",
+        )
+        for r in rows
+    ) or "<div class='alert'>No files yet. Upload one!</div>"
 
-    html = LIST_HTML.format(BASE_CSS=BASE_CSS, home_url=url_for("index"), files_block=items_html)
+    html = _list_tmpl.render(home_url=URL_INDEX, files_block=Markup(items_html))
     return Response(html, mimetype="text/html")
 
 # ---------------------------
 # Cleanup helpers
 # ---------------------------
 
-def _delete_file_record(row: sqlite3.Row):
-    file_path = os.path.join(UPLOAD_DIR, row["stored_name"])
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    finally:
-        with db_conn() as conn:
-            conn.execute("DELETE FROM files WHERE id=?", (row["id"],))
-            conn.commit()
+def _delete_file_record(fid: str):
+    with write_conn() as conn:
+        if HAS_RETURNING:
+            row = conn.execute(SQL_DELETE_FILE_RETURNING, (fid,)).fetchone()
+        else:
+            row = conn.execute(SQL_GET_FILE, (fid,)).fetchone()
+            conn.execute(SQL_DELETE_FILE, (fid,))
+    if row:
+        _remove_upload(row["stored_name"])
 
 def _delete_row_only(fid: str):
-    with db_conn() as conn:
-        conn.execute("DELETE FROM files WHERE id=?", (fid,))
-        conn.commit()
+    with write_conn() as conn:
+        conn.execute(SQL_DELETE_FILE, (fid,))
+
+def _after_response(func, *args):
+    """Run ``func(*args)`` after the current response has been sent."""
+    def _run():
+        try:
+            func(*args)
+        except Exception:
+            app.logger.exception("Post-response cleanup failed")
+
+    @after_this_request
+    def _schedule(resp):
+        resp.call_on_close(_run)
+        return resp
+
+def _call_when_sent(iterable, size: int, callback):
+    """Yield from ``iterable`` and run ``callback`` once ``size`` bytes went out.
+
+    If the client disconnects early the server closes this generator at the
+    pending ``yield``, so the callback never runs.
+    """
+    sent = 0
+    try:
+        for chunk in iterable:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    if sent >= size:
+        try:
+            callback()
+        except Exception:
+            app.logger.exception("Post-download cleanup failed")
+
+def _remove_upload(stored_name: str):
+    try:
+        os.remove(os.path.join(UPLOAD_DIR, stored_name))
+    except FileNotFoundError:
+        pass
+
+def _sweep_expired() -> int:
+    """Delete expired files and their rows in batches; returns the count."""
+    removed = 0
+    while True:
+        with write_conn() as conn:
+            rows = conn.execute(
+                "SELECT id, stored_name FROM files WHERE expires_at <= ? LIMIT ?",
+                (now_ts(), SWEEP_BATCH),
+            ).fetchall()
+            if rows:
+                placeholders = ",".join("?" * len(rows))
+                conn.execute(
+                    f"DELETE FROM files WHERE id IN ({placeholders})",
+                    [r["id"] for r in rows],
+                )
+        for r in rows:
+            _remove_upload(r["stored_name"])
+        removed += len(rows)
+        if len(rows) < SWEEP_BATCH:
+            return removed
+
+def _sweeper():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            _sweep_expired()
+        except Exception:
+            app.logger.exception("Expiry sweep failed")
+
+_sweeper_pid: Optional[int] = None
+_sweeper_lock = threading.Lock()
+
+@app.before_request
+def _start_sweeper():
+    # Started lazily so each worker process gets its own sweeper, including
+    # workers forked from a preloaded app.
+    global _sweeper_pid
+    if _sweeper_pid == os.getpid():
+        return
+    with _sweeper_lock:
+        if _sweeper_pid != os.getpid():
+            threading.Thread(target=_sweeper, name="expiry-sweeper", daemon=True).start()
+            _sweeper_pid = os.getpid()
 
 # ---------------------------
 # Error handlers